@@ -0,0 +1,39 @@
+"""Cost of waiting once for a signal with SignalQueue vs. SignalCatcher
+
+Run with: pytest benchmarks/bench_catchers.py
+"""
+import tracemalloc
+
+import pytest
+
+from qt_await import start_async, SignalQueue, SignalCatcher
+
+
+def wait_once(catcher_cls, emitter):
+    async def waiter():
+        with catcher_cls(emitter.sig) as sq:
+            await sq
+
+    start_async(waiter())
+    emitter.sig.emit(1)
+
+
+@pytest.mark.parametrize("catcher_cls", [SignalQueue, SignalCatcher])
+def test_wait_once(benchmark, qapp, emitter, catcher_cls):
+    wait_once(catcher_cls, emitter)  # Warm up
+
+    # Python allocations only - tracemalloc doesn't see the C++ QObject
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    wait_once(catcher_cls, emitter)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info['peak_bytes_per_wait'] = peak - base
+
+    benchmark(wait_once, catcher_cls, emitter)
+
+
+@pytest.mark.parametrize("catcher_cls", [SignalQueue, SignalCatcher])
+def test_create(benchmark, qapp, catcher_cls):
+    benchmark(catcher_cls)
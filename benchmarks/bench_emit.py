@@ -0,0 +1,43 @@
+"""Throughput of signals captured by SignalQueue & SignalCatcher
+
+Run with: pytest benchmarks/bench_emit.py
+"""
+import tracemalloc
+
+import pytest
+
+from qt_await import ReceivedSignal, SignalQueue, SignalCatcher
+
+N_EMIT = 1000
+
+
+def emit_many(emitter, sq):
+    for i in range(N_EMIT):
+        emitter.sig.emit(i)
+    sq.signals_q.clear()
+    sq.latest.clear()
+
+
+@pytest.mark.parametrize("catcher_cls", [SignalQueue, SignalCatcher])
+def test_emit_buffered(benchmark, qapp, emitter, catcher_cls):
+    with catcher_cls(emitter.sig) as sq:
+        benchmark(emit_many, emitter, sq)
+    benchmark.extra_info['emits_per_sec'] = N_EMIT / benchmark.stats['mean']
+
+
+def test_emit_coalesced(benchmark, qapp, emitter):
+    with SignalCatcher(emitter.sig, coalesce=True) as sq:
+        benchmark(emit_many, emitter, sq)
+    benchmark.extra_info['emits_per_sec'] = N_EMIT / benchmark.stats['mean']
+
+
+def test_received_signal_size(benchmark, qapp, emitter):
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    objs = [ReceivedSignal(None, emitter.sig, (i,)) for i in range(N_EMIT)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objs
+    benchmark.extra_info['bytes_each'] = (size - base) / N_EMIT
+
+    benchmark(ReceivedSignal, None, emitter.sig, (1,))
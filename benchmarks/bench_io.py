@@ -0,0 +1,37 @@
+"""Throughput of reading a subprocess's output with read_streaming_bytes
+
+Run with: pytest benchmarks/bench_io.py
+"""
+import sys
+
+import pytest
+from qtpy import QtCore
+
+from qt_await import start_async, read_streaming_bytes
+
+N_BYTES = 50_000_000
+
+
+def read_process_output(adaptive):
+    loop = QtCore.QEventLoop()
+    proc = QtCore.QProcess()
+    proc.start(sys.executable, [
+        '-c', f'import sys; sys.stdout.buffer.write(b"x" * {N_BYTES})'
+    ])
+
+    async def reader():
+        n = 0
+        async for b in read_streaming_bytes(proc, adaptive=adaptive):
+            n += len(b)
+        assert n == N_BYTES
+        loop.quit()
+
+    start_async(reader())
+    loop.exec()
+    proc.waitForFinished()
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+def test_read_streaming_bytes(benchmark, qapp, adaptive):
+    benchmark.pedantic(read_process_output, args=(adaptive,), rounds=3)
+    benchmark.extra_info['MB_per_sec'] = N_BYTES / 1e6 / benchmark.stats['mean']
@@ -0,0 +1,38 @@
+"""Cost of setting up sleeps and timeouts
+
+Run with: pytest benchmarks/bench_timers.py
+"""
+import time
+
+from qt_await import start_async, sleep
+from qt_await.core import SignalPlumbing
+
+
+def test_timer_entry(benchmark, qapp):
+    plumbing = SignalPlumbing.forCurrentThread()
+
+    def add_and_cancel():
+        plumbing.timer_at(time.monotonic() + 10).cancel()
+
+    benchmark(add_and_cancel)
+
+
+def test_sleep_task(benchmark, qapp):
+    def start_and_cancel():
+        start_async(sleep(10_000)).cancel()
+
+    benchmark(start_and_cancel)
+
+
+def test_many_pending_sleeps(benchmark, qapp):
+    # Adding a timer shouldn't get much slower with lots already waiting
+    tasks = [start_async(sleep(10_000)) for _ in range(100_000)]
+
+    def start_and_cancel():
+        start_async(sleep(5_000)).cancel()
+
+    try:
+        benchmark(start_and_cancel)
+    finally:
+        for task in tasks:
+            task.cancel()
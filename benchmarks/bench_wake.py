@@ -0,0 +1,45 @@
+"""Latency from emitting a signal to a waiting task handling it
+
+Run with: pytest benchmarks/bench_wake.py
+"""
+import pytest
+
+from qt_await import start_async, with_timeout, SignalCatcher
+from qt_await.core import SignalPlumbing
+
+
+@pytest.mark.parametrize("timeout", [False, True])
+def test_wake(benchmark, qapp, emitter, timeout):
+    async def waiter(sq):
+        while True:
+            if timeout:
+                await with_timeout(sq, 10_000)
+            else:
+                await sq
+
+    with SignalCatcher(emitter.sig) as sq:
+        task = start_async(waiter(sq))
+        benchmark(emitter.sig.emit, 1)
+        task.cancel()
+
+
+def test_wake_deferred(benchmark, qapp, emitter):
+    plumbing = SignalPlumbing.forCurrentThread()
+
+    async def waiter(sq):
+        while True:
+            await sq
+
+    def emit_and_run():
+        emitter.sig.emit(1)
+        plumbing.run_ready()
+
+    with SignalCatcher(emitter.sig) as sq:
+        task = start_async(waiter(sq))
+        plumbing.deferred = True
+        try:
+            benchmark(emit_and_run)
+        finally:
+            plumbing.deferred = False
+            plumbing.ready_timer.stop()
+        task.cancel()
@@ -0,0 +1,16 @@
+import pytest
+from qtpy import QtCore
+
+
+@pytest.fixture(scope="session")
+def qapp_cls():
+    return QtCore.QCoreApplication
+
+
+class Emitter(QtCore.QObject):
+    sig = QtCore.Signal(int)
+
+
+@pytest.fixture
+def emitter():
+    return Emitter()
@@ -3,8 +3,8 @@ import time
 from PyQt5 import QtCore, QtNetwork, QtWidgets, QtGui
 
 from qt_await import (
-    connect_async, start_async, SignalQueue, with_timeout,
-    sleep_loop, run_process, read_streaming_text
+    connect_async, start_async, with_timeout,
+    sleep_loop, run_process, read_streaming_text, fetch
 )
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -61,18 +61,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self.print(f"sleep exited with {ec}")
 
     async def http_request(self):
-        mgr = QtNetwork.QNetworkAccessManager()
         req = QtNetwork.QNetworkRequest(QtCore.QUrl("https://pypi.org/"))
-        reply = mgr.get(req)
 
         t0 = time.perf_counter()
-        await SignalQueue(reply.finished)
+        reply, body = await fetch(req)
         t1 = time.perf_counter()
 
         status = reply.attribute(QtNetwork.QNetworkRequest.Attribute.HttpStatusCodeAttribute)
         content_type = reply.header(QtNetwork.QNetworkRequest.KnownHeaders.ContentTypeHeader)
         self.print(f"HTTP response {status} in {t1 - t0:.3f}s")
-        self.print(f"  mime type {content_type}")
+        self.print(f"  mime type {content_type}, {len(body)} bytes")
+        reply.deleteLater()
 
     async def read_stream(self):
         # This works with any QIODevice - illustrated with a QProcess
@@ -4,3 +4,5 @@ __version__ = "0.1"
 
 from .core import *
 from .utils import *
+from .pool import *
+from .monitor import *
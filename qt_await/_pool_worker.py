@@ -0,0 +1,47 @@
+"""Worker process for ProcessPool - this is run as a script
+
+Messages in both directions are pickled objects, each preceded by its length
+as an 8 byte big-endian integer. The first message from the parent is its
+sys.path, so functions can be unpickled by reference. Each message after that
+is a (func, args) pair, and the reply is (True, result) or (False, exception).
+"""
+import pickle
+import struct
+import sys
+
+
+def read_msg(f):
+    header = f.read(8)
+    if len(header) < 8:
+        return None  # Parent closed stdin
+    n, = struct.unpack('!Q', header)
+    return f.read(n)
+
+
+def write_msg(f, obj):
+    try:
+        data = pickle.dumps(obj)
+    except Exception as e:
+        data = pickle.dumps((False, RuntimeError(f"Could not pickle {obj!r}: {e}")))
+    f.write(struct.pack('!Q', len(data)))
+    f.write(data)
+    f.flush()
+
+
+def main():
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    # Anything the functions print shouldn't get mixed up with our replies
+    sys.stdout = sys.stderr
+
+    sys.path[:] = pickle.loads(read_msg(stdin))
+    while (msg := read_msg(stdin)) is not None:
+        try:
+            func, args = pickle.loads(msg)
+            reply = (True, func(*args))
+        except BaseException as e:
+            reply = (False, e)
+        write_msg(stdout, reply)
+
+
+if __name__ == '__main__':
+    main()
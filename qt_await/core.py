@@ -1,6 +1,12 @@
+import heapq
 import inspect
+import itertools
+import math
+import threading
+import time
 import traceback
 import types
+import weakref
 from collections import deque
 from functools import partial
 from inspect import signature
@@ -8,77 +14,493 @@ from inspect import signature
 from qtpy import QtCore
 
 __all__ = [
+    "Cancelled",
+    "CancelScope",
+    "fail_after",
+    "gather",
+    "move_on_after",
     "ReceivedSignal",
+    "Semaphore",
+    "SignalCatcher",
     "SignalQueue",
     "with_timeout",
     "connect_async",
-    "start_async"
+    "start_async",
+    "Task",
+    "TaskGroup",
 ]
 
 
 class SignalPlumbing(QtCore.QObject):
     """Internal machinery, created once per thread"""
+    # Keyed by threading.get_ident(). Each thread only adds & removes its own
+    # entry, and dict operations are atomic, so this doesn't need a lock.
     _thread_insts = {}
 
+    # If this is True, coroutines woken by signals are put in a queue and run
+    # together in a later iteration of the event loop, instead of running
+    # inside the signal emission. This keeps the stack depth bounded when
+    # coroutines wake each other up, and batches work when signals are busy.
+    deferred = False
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.waiting = {}  # id(coro): tuple(things that can wake it up)
-
-    @classmethod
-    def forThread(cls, thread):
-        # The id() of the main thread is inconsistent - I think this is specific
-        # to the main thread because it's started outside Qt. So use a special
-        # ID to find the thread-local instance of it for this class.
-        if thread == QtCore.QCoreApplication.instance().thread():
-            tid = "main"
-        else:
-            tid = id(thread)
-        if tid not in cls._thread_insts:
-            cls._thread_insts[tid] = SignalPlumbing()
-        return cls._thread_insts[tid]
+        self.waiting = {}  # task: tuple(things that can wake it up)
+        self.current = None  # The task which is running a step
+        self.ready = deque()  # (task, value, exc) to run in the next batch
+        self.ready_timer = QtCore.QTimer(self)
+        self.ready_timer.setSingleShot(True)
+        self.ready_timer.setInterval(0)
+        self.ready_timer.timeout.connect(self.run_ready)
+
+        # Deadlines for sleep, with_timeout, etc. are kept in a heap, so one
+        # QTimer can serve any number of them.
+        self.timers = []  # heap of (when, seq, Timer)
+        self.timers_seq = itertools.count()
+        self.timers_cancelled = 0
+        self.heap_timer = QtCore.QTimer(self)
+        self.heap_timer.setSingleShot(True)
+        self.heap_timer.setTimerType(QtCore.Qt.TimerType.PreciseTimer)
+        self.heap_timer.timeout.connect(self.run_timers)
+
+        self.instruments = []  # See Instrument
+
+        # Shared by fetch() calls in this thread
+        self.network_manager = None
+        self.host_semaphores = {}  # (scheme, host, port): Semaphore
 
     @classmethod
     def forCurrentThread(cls):
-        return cls.forThread(QtCore.QThread.currentThread())
+        try:
+            return cls._thread_insts[threading.get_ident()]
+        except KeyError:
+            pass
+
+        tid = threading.get_ident()
+        inst = cls._thread_insts[tid] = SignalPlumbing()
+        # Thread IDs can be reused, so forget this when the thread finishes
+        QtCore.QThread.currentThread().finished.connect(
+            partial(cls._thread_insts.pop, tid, None),
+            QtCore.Qt.ConnectionType.DirectConnection,
+        )
+        return inst
 
     def start_coro(self, coro: types.CoroutineType):
-        self.waiting[id(coro)] = ()
-        self.step_coro(coro, None)
-
-    def step_coro(self, coro, value):
-        # Unhook the coroutine from anything else it was waiting for
-        for catcher in self.waiting.pop(id(coro)):
-            catcher.waiters.pop(id(coro), None)
+        task = Task(coro, self)
+        self.run_step(task, None)
+        return task
+
+    def step_coro(self, task, value, exc=None, defer=False):
+        """Wake up a waiting task, sending it value (or throwing exc into it)
+
+        In deferred mode, or if defer=True, this queues the task to run soon,
+        rather than running it immediately.
+        """
+        # Unhook the task from anything else it was waiting for
+        for catcher in self.waiting.pop(task, ()):
+            catcher.waiters.pop(id(task), None)
+
+        if self.deferred or defer:
+            self.ready.append((task, value, exc))
+            if not self.ready_timer.isActive():
+                self.ready_timer.start()
+        else:
+            self.run_step(task, value, exc)
+
+    def run_ready(self):
+        """Run the tasks queued by step_coro in deferred mode"""
+        # Tasks woken while we're doing this wait for the next batch
+        for _ in range(len(self.ready)):
+            self.run_step(*self.ready.popleft())
+
+    def timer_at(self, when, callback=None):
+        """Make a Timer for a time.monotonic() value, which can be awaited"""
+        timer = Timer(self, when, callback)
+        heapq.heappush(self.timers, (when, next(self.timers_seq), timer))
+        if self.timers[0][2] is timer:
+            self.arm_heap_timer()
+        return timer
+
+    def timer_cancelled(self):
+        # Cancelled timers stay in the heap until they're due, unless they
+        # make up most of it, in which case we clear them out.
+        self.timers_cancelled += 1
+        if self.timers_cancelled > 64 and self.timers_cancelled > len(self.timers) // 2:
+            self.timers = [t for t in self.timers if t[2].active]
+            heapq.heapify(self.timers)
+            self.timers_cancelled = 0
+
+    def arm_heap_timer(self):
+        while self.timers and not self.timers[0][2].active:
+            heapq.heappop(self.timers)
+            self.timers_cancelled -= 1
+        if self.timers:
+            delay = self.timers[0][0] - time.monotonic()
+            self.heap_timer.start(max(0, math.ceil(delay * 1000)))
+        else:
+            self.heap_timer.stop()
 
-        # Run the next step
+    def run_timers(self):
+        t = time.monotonic()
+        # Allow 1 ms early, to avoid starting the QTimer again with 0 delay
+        now = t + 0.001
+        try:
+            while self.timers and self.timers[0][0] <= now:
+                _, _, timer = heapq.heappop(self.timers)
+                if not timer.active:
+                    self.timers_cancelled -= 1
+                    continue
+                try:
+                    for inst in self.instruments:
+                        inst.timer_fired(timer, t - timer.when)
+                    timer.fire()
+                except Exception:
+                    # Don't let one failing timer stop the others
+                    traceback.print_exc()
+        finally:
+            # Every timer in this thread depends on this, so it must happen
+            self.arm_heap_timer()
+
+    def run_step(self, task, value, exc=None):
+        prev_task, self.current = self.current, task
+        # Snapshot, so an instrument installed during the step doesn't get
+        # after_step without before_step
+        instruments = tuple(self.instruments)
+        for inst in instruments:
+            inst.before_step(task)
+        finished = True
         try:
-            catchers = coro.send(value)
-        except StopIteration:
+            if exc is None:
+                catchers = task.coro.send(value)
+            else:
+                catchers = task.coro.throw(exc)
+        except StopIteration as si:
             # This coroutine has finished normally
-            return
+            result, error = si.value, None
         except BaseException as e:
             # This coroutine errored out
-            print("Uncaught exception in", coro.__qualname__)
-            traceback.print_exception(e)
-            return
+            result, error = None, e
+        else:
+            finished = False
+            if task._pending_exc is not None:
+                # It was cancelled while running: throw that in next time
+                exc, task._pending_exc = task._pending_exc, None
+                self.step_coro(task, None, exc, defer=True)
+                return
+
+            # Hook up what it's waiting for to continue
+            for catcher in catchers:
+                try:
+                    catcher.waiters[id(task)] = task
+                except AttributeError:
+                    raise TypeError(f"Unexpected {type(catcher)}") from None
 
-        # Hook up what it's waiting for to continue
-        for catcher in catchers:
-            if isinstance(catcher, SignalQueue):
-                catcher.waiters[id(coro)] = coro
-            else:
-                raise TypeError(f"Unexpected {type(catcher)}")
+            self.waiting[task] = catchers
+            return
+        finally:
+            self.current = prev_task
+            for inst in instruments:
+                inst.after_step(task, finished)
 
-        self.waiting[id(coro)] = catchers
+        task._finish(result, error)
 
 
 class Cancelled(BaseException):
-    """Raised inside tasks when they are cancelled by a timeout"""
+    """Raised inside tasks when they are cancelled, e.g. by a timeout"""
     pass
 
 
+class Task:
+    """A running coroutine, returned by :func:`start_async`
+
+    ``await`` a task to wait for it to finish and get its return value (or
+    exception). Use ``.cancel()`` to raise Cancelled inside it.
+    """
+    __slots__ = (
+        'coro', 'plumbing', 'waiters', 'callbacks', 'owned',
+        '_done', '_result', '_exception', '_pending_exc', '_observed',
+    )
+
+    def __init__(self, coro, plumbing):
+        self.coro = coro
+        self.plumbing = plumbing
+        self.waiters = {}
+        self.callbacks = []
+        self.owned = {}  # id(queue): signal queues to close when finished
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._pending_exc = None  # To throw in when a running task next waits
+        self._observed = False  # Has something outside qt_await seen the result?
+
+    def __repr__(self):
+        state = 'done' if self._done else 'running'
+        return f"<Task {self.coro.__qualname__} ({state})>"
+
+    def done(self):
+        """True if the coroutine has finished, successfully or not"""
+        return self._done
+
+    def result(self):
+        """Get the return value of the coroutine, or raise its exception"""
+        if not self._done:
+            raise RuntimeError("Task is not finished")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        """Get the exception the coroutine raised, or None"""
+        if not self._done:
+            raise RuntimeError("Task is not finished")
+        return self._exception
+
+    def cancel(self):
+        """Raise Cancelled inside the coroutine where it's waiting
+
+        The task stops waiting for whatever it was waiting for, and its
+        cleanup code (``except Cancelled``, ``finally`` and ``with`` blocks)
+        runs - immediately, unless the plumbing is in deferred mode. If the
+        task is running (e.g. it cancels itself), Cancelled is raised at its
+        next ``await`` instead.
+
+        Returns False if the task had already finished.
+        """
+        if self._done:
+            return False
+        self._throw(Cancelled("Task cancelled"))
+        return True
+
+    def _throw(self, exc):
+        """Raise exc inside the coroutine where it's waiting"""
+        plumbing = self.plumbing
+        if self in plumbing.waiting:
+            plumbing.step_coro(self, None, exc)
+            return
+        # Already woken up & queued to run in deferred mode: throw instead
+        for i, (task, _, _) in enumerate(plumbing.ready):
+            if task is self:
+                plumbing.ready[i] = (self, None, exc)
+                return
+        # Running: we can't throw into it until it waits for something
+        self._pending_exc = exc
+
+    def add_done_callback(self, fn):
+        """Call fn(task) when the task finishes"""
+        self._observed = True
+        self._add_internal_callback(fn)
+
+    def _add_internal_callback(self, fn):
+        # Like add_done_callback, but for bookkeeping which doesn't look at
+        # the result, so uncaught exceptions are still printed
+        if self._done:
+            fn(self)
+        else:
+            self.callbacks.append(fn)
+
+    def _finish(self, result, exception):
+        self._done = True
+        self._pending_exc = None
+        self._result = result
+        self._exception = exception
+        for catcher in list(self.owned.values()):
+            catcher.close()
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        if exception is not None and not (waiters or self._observed) \
+                and not isinstance(exception, Cancelled):
+            # Nothing is waiting to handle the exception
+            print("Uncaught exception in", self.coro.__qualname__)
+            traceback.print_exception(exception)
+        callbacks, self.callbacks = self.callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                # Don't stop the other callbacks & waiters being called
+                print("Error in done callback for", self.coro.__qualname__)
+                traceback.print_exc()
+        for waiter in waiters:
+            self.plumbing.step_coro(waiter, self)
+
+    def __await__(self):
+        if not self._done:
+            yield (self,)
+        return self.result()
+
+
+class Timer:
+    """An entry in SignalPlumbing's timer heap
+
+    ``await`` it to wait until the time is reached. Create these with
+    ``SignalPlumbing.timer_at()``.
+    """
+    __slots__ = ('plumbing', 'when', 'callback', 'waiters', 'active')
+
+    def __init__(self, plumbing, when, callback=None):
+        self.plumbing = plumbing
+        self.when = when
+        self.callback = callback
+        self.waiters = {}
+        self.active = True
+
+    def cancel(self):
+        """Stop the timer, if it hasn't already fired"""
+        if self.active:
+            self.active = False
+            self.waiters.clear()
+            self.plumbing.timer_cancelled()
+
+    def fire(self):
+        self.active = False
+        if self.callback is not None:
+            self.callback()
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        for waiter in waiters:
+            self.plumbing.step_coro(waiter, self)
+
+    def __await__(self):
+        if self.active:
+            yield (self,)
+
+
+class _wait_any:
+    """Wait until any of several catchers (e.g. Tasks) wakes us up"""
+    def __init__(self, catchers):
+        self.catchers = tuple(catchers)
+
+    def __await__(self):
+        return (yield self.catchers)
+
+
+class TaskGroup:
+    """Run several tasks concurrently & wait for all of them to finish
+
+    Use it with ``async with``, and start child tasks inside the block::
+
+        async with TaskGroup() as tg:
+            tg.start(download(url1))
+            tg.start(download(url2))
+        # Both downloads are finished here
+
+    If a child task fails, the others are cancelled, and the exception is
+    raised from the ``async with`` block once they have all finished.
+    """
+    def __init__(self):
+        self.plumbing = SignalPlumbing.forCurrentThread()
+        self.tasks = []
+        self.error = None
+
+    def start(self, coro) -> Task:
+        """Start a coroutine as a child task of this group"""
+        task = Task(coro, self.plumbing)
+        task.add_done_callback(self._child_done)
+        self.tasks.append(task)
+        self.plumbing.run_step(task, None)
+        if self.error is not None:
+            task.cancel()  # Another child already failed
+        return task
+
+    def cancel(self):
+        """Cancel all child tasks which haven't finished"""
+        for task in self.tasks:
+            task.cancel()
+
+    def _child_done(self, task):
+        exc = task._exception
+        if exc is not None and self.error is None \
+                and not isinstance(exc, Cancelled):
+            self.error = exc
+            self.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc is not None:
+            # The body of the async with block failed
+            self.cancel()
+
+        while pending := [t for t in self.tasks if not t.done()]:
+            try:
+                await _wait_any(pending)
+            except Cancelled:
+                self.cancel()
+                raise
+
+        if self.error is not None:
+            raise self.error
+        return False
+
+
+class Semaphore:
+    """Limit how many tasks can do something at the same time
+
+    Use it with ``async with sem:``, or call ``await sem.acquire()`` and
+    ``sem.release()``. value is the number of tasks which can hold it at once.
+    """
+    __slots__ = ('value', 'waiters')
+
+    def __init__(self, value=1):
+        self.value = value
+        self.waiters = {}
+
+    def locked(self):
+        """True if acquire() would have to wait"""
+        return self.value <= 0
+
+    @types.coroutine
+    def acquire(self):
+        try:
+            while self.value <= 0:
+                yield (self,)
+        except BaseException:
+            # If we were woken up but can't take it, pass it on to the next
+            self._wake_next()
+            raise
+        self.value -= 1
+
+    def release(self):
+        self.value += 1
+        self._wake_next()
+
+    def _wake_next(self):
+        if self.value > 0 and self.waiters:
+            k = next(iter(self.waiters))
+            task = self.waiters.pop(k)
+            task.plumbing.step_coro(task, self)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+async def gather(*awaitables):
+    """Run several coroutines concurrently, and return a list of their results
+
+    The arguments can also be other awaitable objects, like SignalQueue or Task.
+    If one fails, the others are cancelled and the exception is raised.
+    """
+    async with TaskGroup() as tg:
+        tasks = [
+            tg.start(aw if inspect.iscoroutine(aw) else _await(aw))
+            for aw in awaitables
+        ]
+    return [t.result() for t in tasks]
+
+
 class ReceivedSignal:
     """Received signal object - can be unpacked to the signal arguments"""
+    __slots__ = ('sender', 'signal', 'args')
+
     def __init__(self, sender, signal, args):
         self.sender = sender
         self.signal = signal
@@ -94,45 +516,207 @@ class ReceivedSignal:
         return iter(self.args)
 
 
-class SignalQueue(QtCore.QObject):
-    """Capture emitted signals and return them via await
+def _weak_slot(queue, signal):
+    """Make a slot passing signals on to queue, without keeping it alive"""
+    ref = weakref.ref(queue)
 
-    ``await`` an instance of SignalQueue to get the next signal it captures.
-    When a signal is ready, the caller gets back a ReceivedSignal object.
+    def slot(*args):
+        queue = ref()
+        if queue is not None:
+            queue.on_signal(signal, *args)
+            return
+        # The queue was discarded without closing it
+        try:
+            signal.disconnect(slot)
+        except (TypeError, RuntimeError):
+            pass
 
-    By default the queue will keep any amount of signals that arrive before you
-    await them. If max_buffer_size is set, new signals will replace older ones
-    once the buffer fills up. Either way can be tricky.
-    """
-    def __init__(self, *signals, max_buffer_size=None):
-        super().__init__()
+    return slot
+
+
+class _SignalBuffer:
+    """Parts shared by SignalQueue and SignalCatcher"""
+    __slots__ = ()
+
+    def _setup(self, signals, max_buffer_size, coalesce, auto_close):
+        if coalesce not in (False, True, 'per_signal'):
+            raise ValueError(f"Unexpected value for coalesce: {coalesce!r}")
         self.signals_q = deque(maxlen=max_buffer_size)
+        self.coalesce = coalesce
+        self.latest = {}  # Coalescing mode: key -> [sender, signal, args]
         self.waiters = {}
+        self.connections = []
+        self.closed = False
         for signal in signals:
             self.add(signal)
 
+        self.owner = None
+        if auto_close:
+            # Disconnect when the task creating this finishes
+            self.owner = SignalPlumbing.forCurrentThread().current
+            if self.owner is None:
+                raise RuntimeError("auto_close=True can only be used in a task")
+            self.owner.owned[id(self)] = self
+
     def add(self, signal):
-        signal.connect(partial(self.on_signal, signal))
+        slot = _weak_slot(self, signal)
+        signal.connect(slot)
+        self.connections.append((signal, slot))
 
-    def on_signal(self, signal, *args):
-        sig_obj = ReceivedSignal(self.sender(), signal, args)
-        if self.waiters:
+    def close(self):
+        """Disconnect from all signals & discard any that are queued
+
+        Tasks waiting for a signal from the queue get RuntimeError.
+        """
+        self.closed = True
+        for signal, slot in self.connections:
+            try:
+                signal.disconnect(slot)
+            except (TypeError, RuntimeError):
+                pass  # Already disconnected, or the sender was deleted
+        self.connections.clear()
+        self.signals_q.clear()
+        self.latest.clear()
+        if self.owner is not None:
+            self.owner.owned.pop(id(self), None)
+            self.owner = None
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        for task in waiters:
+            task.plumbing.step_coro(task, None, RuntimeError("Signal queue closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _receive(self, sender, signal, args):
+        if self.coalesce:
+            self._receive_coalesced(sender, signal, args)
+        elif self.waiters:
             # Something is waiting for a signal - deliver it immediately
             k = next(iter(self.waiters))
-            coro = self.waiters.pop(k)
-            SignalPlumbing.forCurrentThread().step_coro(coro, sig_obj)
+            task = self.waiters.pop(k)
+            task.plumbing.step_coro(task, ReceivedSignal(sender, signal, args))
         else:
             # Nothing waiting, queue the signal until it's requested
-            self.signals_q.append(sig_obj)
+            self.signals_q.append(ReceivedSignal(sender, signal, args))
+
+    def _receive_coalesced(self, sender, signal, args):
+        key = signal if self.coalesce == 'per_signal' else None
+        slot = self.latest.get(key)
+        if slot is None:
+            self.latest[key] = [sender, signal, args]
+        else:
+            # Overwrite the previous signal in place
+            slot[0] = sender
+            slot[1] = signal
+            slot[2] = args
+
+        if self.waiters:
+            # Wake the waiting task on the next event loop iteration, so it
+            # gets the latest signal when several arrive together.
+            k = next(iter(self.waiters))
+            task = self.waiters.pop(k)
+            task.plumbing.step_coro(task, None, defer=True)
+
+    def _pop_latest(self):
+        key = next(iter(self.latest))
+        return ReceivedSignal(*self.latest.pop(key))
+
+    def drain(self, max_n=None):
+        """Take a list of the signals already queued, without waiting
+
+        If max_n is given, at most that many are returned, oldest first.
+        """
+        q = self.signals_q
+        if max_n is None:
+            batch = list(q)
+            q.clear()
+        else:
+            batch = [q.popleft() for _ in range(min(max_n, len(q)))]
+        while self.latest and (max_n is None or len(batch) < max_n):
+            batch.append(self._pop_latest())
+        return batch
+
+    @types.coroutine
+    def get_batch(self, max_n=None):
+        """Wait for at least one signal, then return a list of queued signals
+
+        ``await sq.get_batch()`` handles a burst of signals with one
+        resumption of the awaiting task, rather than one per signal.
+        """
+        if self.signals_q or self.latest:
+            return self.drain(max_n)
+        first = yield from self.__await__()
+        return [first] + self.drain(None if max_n is None else max_n - 1)
 
     def __await__(self):
         if self.signals_q:
             return self.signals_q.popleft()
+        if self.closed:
+            raise RuntimeError("Signal queue closed")
+
+        if self.coalesce:
+            while not self.latest:
+                yield (self,)
+            return self._pop_latest()
 
         sig_obj = yield (self,)
         return sig_obj
 
 
+class SignalQueue(QtCore.QObject, _SignalBuffer):
+    """Capture emitted signals and return them via await
+
+    ``await`` an instance of SignalQueue to get the next signal it captures.
+    When a signal is ready, the caller gets back a ReceivedSignal object.
+
+    By default the queue will keep any amount of signals that arrive before you
+    await them. If max_buffer_size is set, new signals will replace older ones
+    once the buffer fills up. Either way can be tricky.
+
+    With coalesce=True, only the latest signal is kept, and a waiting task is
+    woken at most once per event loop iteration, however often the signal is
+    emitted. coalesce='per_signal' is similar, but keeps the latest emission
+    of each signal added to the queue.
+
+    Call ``.close()``, or use it in a ``with`` block, to disconnect it from
+    the signals. A queue which is discarded without closing it stops receiving
+    signals once it's garbage collected. With auto_close=True, it's closed
+    when the task creating it (a coroutine started with ``start_async`` or
+    ``connect_async``) finishes.
+    """
+    def __init__(self, *signals, max_buffer_size=None, coalesce=False,
+                 auto_close=False):
+        super().__init__()
+        self._setup(signals, max_buffer_size, coalesce, auto_close)
+
+    def on_signal(self, signal, *args):
+        self._receive(self.sender(), signal, args)
+
+
+class SignalCatcher(_SignalBuffer):
+    """A lighter version of SignalQueue, which is not a QObject
+
+    This works the same way, but the ReceivedSignal objects it produces have
+    ``.sender`` set to None. Creating one of these is much cheaper than
+    a SignalQueue, so it's better for short-lived waits.
+    """
+    __slots__ = (
+        'signals_q', 'coalesce', 'latest', 'waiters', 'connections', 'closed',
+        'owner', '__weakref__',
+    )
+
+    def __init__(self, *signals, max_buffer_size=None, coalesce=False,
+                 auto_close=False):
+        self._setup(signals, max_buffer_size, coalesce, auto_close)
+
+    def on_signal(self, signal, *args):
+        self._receive(None, signal, args)
+
+
 class with_timeout:
     """Run a coroutine with a time limit
 
@@ -144,57 +728,230 @@ class with_timeout:
     def __init__(self, awaitable, timeout_ms):
         if inspect.iscoroutine(awaitable):
             self.coro = awaitable
-        elif isinstance(awaitable, SignalQueue):
+        elif isinstance(awaitable, _SignalBuffer):
             self.coro = awaitable.__await__()
         else:
             raise TypeError(
                 f"Expected coroutine or SignalQueue, not {type(awaitable)}"
             )
-        self.timer = QtCore.QTimer()
-        self.timer.setSingleShot(True)
-        self.timer.setInterval(timeout_ms)
+        self.timeout_ms = timeout_ms
 
     def __await__(self):
-        timeout_q = SignalQueue(self.timer.timeout)
-        self.timer.start()
+        deadline = SignalPlumbing.forCurrentThread().timer_at(
+            time.monotonic() + self.timeout_ms / 1000
+        )
 
-        signal = None  # To start coroutine
+        value, exc = None, None  # To start coroutine
 
-        while True:
-            try:
-                sig_qs = self.coro.send(signal)
-            except StopIteration as si:
-                # Coroutine finished successfully
-                self.timer.stop()
-                return si.value
-            except:
-                # Error in coroutine
-                self.timer.stop()
-                raise
+        try:
+            while True:
+                try:
+                    if exc is None:
+                        catchers = self.coro.send(value)
+                    else:
+                        catchers = self.coro.throw(exc)
+                except StopIteration as si:
+                    # Coroutine finished successfully
+                    return si.value
 
-            signal = yield (sig_qs + (timeout_q,))
-            if signal.signal == self.timer.timeout:
                 try:
-                    self.coro.throw(Cancelled("Cancelled by timeout"))
-                except (Cancelled, StopIteration):
-                    pass
-                raise TimeoutError(f"Timeout expired ({self.timer.interval()} ms)")
+                    value, exc = (yield (catchers + (deadline,))), None
+                except GeneratorExit:
+                    self.coro.close()
+                    raise
+                except BaseException as e:
+                    # e.g. the task was cancelled: pass it to the coroutine
+                    value, exc = None, e
+                    continue
+
+                if value is deadline:
+                    try:
+                        self.coro.throw(Cancelled("Cancelled by timeout"))
+                    except (Cancelled, StopIteration):
+                        pass
+                    raise TimeoutError(f"Timeout expired ({self.timeout_ms} ms)")
+        finally:
+            deadline.cancel()
+
+
+class CancelScope:
+    """Cancel the code in an ``async with`` block after a time limit
+
+    Create these with :func:`move_on_after` or :func:`fail_after`. When the
+    deadline passes, Cancelled is raised at whatever the task is waiting for
+    inside the block. Scopes can be nested; each one only handles its own
+    cancellation.
+    """
+    __slots__ = ('timeout_ms', 'raise_timeout', 'task', 'deadline',
+                 'cancelled_caught')
+
+    def __init__(self, timeout_ms, raise_timeout):
+        self.timeout_ms = timeout_ms
+        self.raise_timeout = raise_timeout
+        self.task = None
+        self.deadline = None
+        self.cancelled_caught = False
+
+    def _expire(self):
+        if not self.task.done():
+            exc = Cancelled(f"Cancelled by timeout ({self.timeout_ms} ms)")
+            exc.scope = self
+            self.task._throw(exc)
+
+    async def __aenter__(self):
+        plumbing = SignalPlumbing.forCurrentThread()
+        if plumbing.current is None:
+            raise RuntimeError("Cancel scopes can only be used inside a task")
+        self.task = plumbing.current
+        self.deadline = plumbing.timer_at(
+            time.monotonic() + self.timeout_ms / 1000, self._expire
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.deadline.cancel()
+        if isinstance(exc, Cancelled) and getattr(exc, 'scope', None) is self:
+            self.cancelled_caught = True
+            if self.raise_timeout:
+                raise TimeoutError(f"Timeout expired ({self.timeout_ms} ms)")
+            return True
+        return False
+
+
+def move_on_after(timeout_ms):
+    """Stop running an ``async with`` block after timeout_ms
+
+    Execution continues after the block. ``.cancelled_caught`` on the scope
+    tells you if it was stopped early::
+
+        async with move_on_after(1000) as scope:
+            ...
+        if scope.cancelled_caught:
+            ...
+    """
+    return CancelScope(timeout_ms, raise_timeout=False)
+
+
+def fail_after(timeout_ms):
+    """Like move_on_after, but raise TimeoutError when the time runs out"""
+    return CancelScope(timeout_ms, raise_timeout=True)
+
+
+def _debounced(fn, ms):
+    """Call fn once calls to the wrapper stop for ms, with the latest args"""
+    timer = None
+
+    def wrapper(*args):
+        nonlocal timer
+        if timer is not None:
+            timer.cancel()
+        timer = SignalPlumbing.forCurrentThread().timer_at(
+            time.monotonic() + ms / 1000, partial(fn, *args)
+        )
 
+    return wrapper
 
-def connect_async(signal, async_slot):
-    """Connect a Qt signal to an ``async def`` function slot"""
+
+def _throttled(fn, ms):
+    """Call fn at most once every ms. Calls in between are merged into one
+    call with the latest args at the end of the interval.
+    """
+    timer = None
+    pending = None
+
+    def start_timer():
+        nonlocal timer
+        timer = SignalPlumbing.forCurrentThread().timer_at(
+            time.monotonic() + ms / 1000, timer_fired
+        )
+
+    def timer_fired():
+        nonlocal pending
+        if pending is not None:
+            args, pending = pending, None
+            fn(*args)
+            start_timer()
+
+    def wrapper(*args):
+        nonlocal pending
+        if timer is None or not timer.active:
+            fn(*args)
+            start_timer()
+        else:
+            pending = args
+
+    return wrapper
+
+
+def connect_async(signal, async_slot, max_concurrent=None, overflow='queue',
+                  max_queued=None, debounce=None, throttle=None):
+    """Connect a Qt signal to an ``async def`` function slot
+
+    Each time the signal is emitted, the slot starts as a new task.
+    If max_concurrent is set, at most that many tasks run at once, and
+    overflow controls what happens when the signal is emitted again:
+
+    - ``'drop'``: ignore the new signal.
+    - ``'queue'``: start a task for it when a running one finishes. By
+      default, any number of signals can wait (so memory use isn't bounded).
+      If max_queued is set, only that many of the latest signals wait.
+    - ``'restart'``: cancel the oldest running task, and start a new one for
+      the latest signal.
+
+    To avoid starting the slot too often when the signal is emitted
+    repeatedly, pass a time in ms as one (not both) of these:
+
+    - debounce: start the slot once the signal hasn't been emitted for this
+      long, with the arguments from the last emission.
+    - throttle: start the slot at most once in this time. If the signal is
+      emitted again in that time, the slot starts at the end of it with the
+      latest arguments.
+    """
+    if overflow not in ('drop', 'queue', 'restart'):
+        raise ValueError(f"Unexpected value for overflow: {overflow!r}")
+    if max_concurrent is not None and max_concurrent < 1:
+        raise ValueError(f"max_concurrent must be at least 1, not {max_concurrent}")
+    if debounce is not None and throttle is not None:
+        raise ValueError("Pass only one of debounce and throttle")
     nargs = len(signature(async_slot).parameters)
-    slot_owner: QtCore.QObject = async_slot.__self__
-    plumbing = SignalPlumbing.forThread(slot_owner.thread())
+    running = deque()  # Tasks
+    # Argument tuples waiting to start. In restart mode, this is only used if
+    # a cancelled task doesn't finish immediately.
+    queued = deque(maxlen=1 if overflow == 'restart' else max_queued)
 
-    def start_slot(*args):
-        args = args[:nargs]
+    def start(args):
         coro = async_slot(*args)
-        plumbing.start_coro(coro)
+        task = SignalPlumbing.forCurrentThread().start_coro(coro)
+        if max_concurrent is not None and not task.done():
+            running.append(task)
+            task._add_internal_callback(finished)
 
-    signal.connect(start_slot)
+    def finished(task):
+        running.remove(task)
+        if queued and len(running) < max_concurrent:
+            start(queued.popleft())
 
-
-def start_async(coro):
-    """Start running an ``async def`` function with Qt"""
+    def start_slot(*args):
+        args = args[:nargs]
+        if max_concurrent is None or len(running) < max_concurrent:
+            start(args)
+        elif overflow == 'queue':
+            queued.append(args)
+        elif overflow == 'restart':
+            queued.append(args)
+            running[0].cancel()  # Starts the queued task once it's finished
+
+    if debounce is not None:
+        signal.connect(_debounced(start_slot, debounce))
+    elif throttle is not None:
+        signal.connect(_throttled(start_slot, throttle))
+    else:
+        signal.connect(start_slot)
+
+
+def start_async(coro) -> Task:
+    """Start running an ``async def`` function with Qt
+
+    Returns a Task, which can be awaited or cancelled.
+    """
     return SignalPlumbing.forCurrentThread().start_coro(coro)
@@ -0,0 +1,169 @@
+import time
+from collections import deque
+
+from .core import SignalPlumbing
+
+__all__ = ["Instrument", "LagMonitor", "CoroutineStats"]
+
+
+class Instrument:
+    """Base class for hooks into how tasks run
+
+    Subclass this and override the hook methods you need, then call
+    ``.install()`` to start using it for the current thread. Hooks are
+    called for every step of every task, so they should be quick.
+    """
+    plumbing = None
+
+    def install(self):
+        """Start receiving hook calls for the current thread"""
+        self.plumbing = SignalPlumbing.forCurrentThread()
+        if self not in self.plumbing.instruments:
+            self.plumbing.instruments.append(self)
+
+    def uninstall(self):
+        """Stop receiving hook calls"""
+        if self.plumbing is not None and self in self.plumbing.instruments:
+            self.plumbing.instruments.remove(self)
+        self.plumbing = None
+
+    def before_step(self, task):
+        """Called when a task is about to be resumed"""
+
+    def after_step(self, task, finished):
+        """Called when a task has waited again, or finished (finished=True)
+
+        Steps can be nested: a task can wake up another one, which runs
+        before the first task's step finishes.
+        """
+
+    def timer_fired(self, timer, seconds_late):
+        """Called when a timer (e.g. for ``sleep()``) fires"""
+
+
+class _StepTimer:
+    """Time nested steps, excluding the time of steps inside each one"""
+    __slots__ = ('clock', 'stack')
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.stack = []  # [start time, time in nested steps]
+
+    def start(self):
+        self.stack.append([self.clock(), 0.])
+
+    def stop(self):
+        """Finish a step, returning its time without nested steps"""
+        start, nested = self.stack.pop()
+        elapsed = self.clock() - start
+        if self.stack:
+            self.stack[-1][1] += elapsed
+        return elapsed - nested
+
+
+def _percentiles(samples, percents):
+    if not samples:
+        return {p: None for p in percents}
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {p: ordered[min(n - 1, int(n * p / 100))] for p in percents}
+
+
+class LagMonitor(Instrument):
+    """Measure how long async code blocks the Qt event loop
+
+    ``monitor.install()`` starts recording, for the current thread:
+
+    - How long each step of a task takes, i.e. the time from when it is woken
+      up until it next waits (``step_percentiles()``).
+    - How late timers (``sleep``, ``sleep_loop``, ``with_timeout``) wake up
+      compared to when they were due (``timer_delay_percentiles()``). If this
+      is large, something is keeping the event loop busy.
+
+    A step's time doesn't include other tasks it wakes up, which run inside
+    it. All times are in ms. If threshold_ms is set, ``callback(task, ms)`` is
+    called for any step taking longer than that; by default, it prints a
+    warning. The last max_samples measurements of each kind are kept.
+    """
+    def __init__(self, threshold_ms=None, callback=None, max_samples=10_000):
+        self.threshold_ms = threshold_ms
+        self.callback = callback or self.warn_slow_step
+        self.step_times = deque(maxlen=max_samples)
+        self.timer_delays = deque(maxlen=max_samples)
+        self.steps = _StepTimer(time.perf_counter)
+
+    @staticmethod
+    def warn_slow_step(task, ms):
+        print(f"Slow step in {task.coro.__qualname__}: {ms:.1f} ms")
+
+    def before_step(self, task):
+        self.steps.start()
+
+    def after_step(self, task, finished):
+        ms = self.steps.stop() * 1000
+        self.step_times.append(ms)
+        if self.threshold_ms is not None and ms > self.threshold_ms:
+            self.callback(task, ms)
+
+    def timer_fired(self, timer, seconds_late):
+        self.timer_delays.append(max(0., seconds_late * 1000))
+
+    def step_percentiles(self, percents=(50, 90, 99, 100)):
+        """Get a dict of step time (ms) at each percentile"""
+        return _percentiles(self.step_times, percents)
+
+    def timer_delay_percentiles(self, percents=(50, 90, 99, 100)):
+        """Get a dict of how late timers fired (ms) at each percentile"""
+        return _percentiles(self.timer_delays, percents)
+
+
+class _Counts:
+    __slots__ = ('steps', 'cpu', 'wait')
+
+    def __init__(self):
+        self.steps = 0
+        self.cpu = 0.
+        self.wait = 0.
+
+
+class CoroutineStats(Instrument):
+    """Count steps, CPU time & waiting time for each coroutine function
+
+    ``stats.install()`` starts recording, for the current thread, and
+    ``print(stats.table())`` shows the results. ``stats.counts`` is a dict of
+    coroutine ``__qualname__`` to objects with ``steps`` (resumptions),
+    ``cpu`` and ``wait`` attributes (times in seconds).
+
+    CPU time for a step doesn't include other tasks it wakes up, which run
+    inside it. Wait time is from when a task waits until it's resumed.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.steps = _StepTimer(time.thread_time)
+        self.suspended = {}  # Task: time.perf_counter() when it waited
+
+    def before_step(self, task):
+        name = task.coro.__qualname__
+        if (counts := self.counts.get(name)) is None:
+            counts = self.counts[name] = _Counts()
+        counts.steps += 1
+        if (t := self.suspended.pop(task, None)) is not None:
+            counts.wait += time.perf_counter() - t
+        self.steps.start()
+
+    def after_step(self, task, finished):
+        cpu = self.steps.stop()
+        self.counts[task.coro.__qualname__].cpu += cpu
+        if not finished:
+            self.suspended[task] = time.perf_counter()
+
+    def table(self):
+        """Format the statistics as a table, sorted by CPU time"""
+        rows = sorted(self.counts.items(), key=lambda kv: kv[1].cpu, reverse=True)
+        width = max([len('Coroutine')] + [len(name) for name in self.counts])
+        lines = [f"{'Coroutine':<{width}}  {'Steps':>8}  {'CPU (ms)':>10}  {'Wait (ms)':>10}"]
+        for name, c in rows:
+            lines.append(
+                f"{name:<{width}}  {c.steps:>8}  {c.cpu * 1000:>10.1f}  {c.wait * 1000:>10.1f}"
+            )
+        return '\n'.join(lines)
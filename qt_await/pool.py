@@ -0,0 +1,148 @@
+import os
+import pickle
+import struct
+import sys
+from collections import deque
+
+from qtpy import QtCore
+
+from .core import Cancelled, Semaphore, SignalCatcher
+
+__all__ = ["ProcessPool"]
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), '_pool_worker.py')
+
+
+def _frame(obj):
+    data = pickle.dumps(obj)
+    return struct.pack('!Q', len(data)) + data
+
+
+def _reap(proc):
+    """Let a process finish in the background, then delete it
+
+    Deleting a running QProcess blocks until it exits, so instead the
+    application keeps it until then.
+    """
+    proc.setParent(QtCore.QCoreApplication.instance())
+    proc.finished.connect(proc.deleteLater)
+    if proc.state() == QtCore.QProcess.ProcessState.NotRunning:
+        proc.deleteLater()
+
+
+class _Worker:
+    """One Python process in a ProcessPool"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.closed = False
+        self.start()
+
+    def start(self):
+        self.proc = QtCore.QProcess()
+        self.proc.setProcessChannelMode(QtCore.QProcess.ProcessChannelMode.ForwardedErrorChannel)
+        self.proc.start(sys.executable, [WORKER_SCRIPT])
+        self.proc.write(_frame(sys.path))
+        self.buffer.clear()
+
+    def restart(self):
+        self.proc.kill()
+        _reap(self.proc)
+        self.start()
+
+    def close(self, kill=False):
+        self.closed = True
+        if kill:
+            self.proc.kill()
+        else:
+            self.proc.closeWriteChannel()  # Worker exits when stdin closes
+        _reap(self.proc)
+
+    def take_msg(self):
+        """Get one pickled message from the buffer, if it has a complete one"""
+        if len(self.buffer) < 8:
+            return None
+        n, = struct.unpack_from('!Q', self.buffer)
+        if len(self.buffer) < 8 + n:
+            return None
+        data = bytes(self.buffer[8:8 + n])
+        del self.buffer[:8 + n]
+        return data
+
+    async def call(self, func, args):
+        if self.closed:
+            raise RuntimeError("ProcessPool is closed")
+        if self.proc.state() == QtCore.QProcess.ProcessState.NotRunning:
+            self.start()  # It died while it was idle
+
+        proc = self.proc
+        with SignalCatcher(proc.readyReadStandardOutput, proc.finished) as sq:
+            proc.write(_frame((func, args)))
+            try:
+                data = self.take_msg()
+                while data is None:
+                    sig = await sq
+                    self.buffer += bytes(proc.readAllStandardOutput())
+                    data = self.take_msg()
+                    if data is None and sig.signal == proc.finished:
+                        if self.closed:
+                            raise RuntimeError(f"ProcessPool closed while running {func!r}")
+                        self.start()
+                        raise RuntimeError(f"Worker process exited while running {func!r}")
+            except Cancelled:
+                # We don't want the result from this job, so start a new worker
+                if not self.closed:
+                    self.restart()
+                raise
+
+        try:
+            ok, value = pickle.loads(data)
+        except Exception as e:
+            # We can't tell if the stream is garbled, so don't reuse this worker
+            if not self.closed:
+                self.restart()
+            raise RuntimeError(f"Could not unpickle result of {func!r}: {e!r}") from e
+        if not ok:
+            raise value
+        return value
+
+
+class ProcessPool:
+    """Run Python functions in a pool of worker processes
+
+    ``await pool.submit(func, *args)`` runs the function in one of the worker
+    processes and returns its result. The workers start when the pool is
+    created and are reused for many calls, so each call doesn't pay for
+    starting Python. The function & arguments must be picklable.
+
+    Call ``.close()`` or use the pool in a ``with`` block to stop the workers.
+    """
+    def __init__(self, n_workers=None):
+        if n_workers is None:
+            n_workers = QtCore.QThread.idealThreadCount()
+        self.workers = [_Worker() for _ in range(n_workers)]
+        self.idle = deque(self.workers)
+        self.sem = Semaphore(n_workers)
+
+    async def submit(self, func, *args):
+        """Call func(*args) in a worker process, and wait for the result"""
+        async with self.sem:
+            worker = self.idle.popleft()
+            try:
+                return await worker.call(func, args)
+            finally:
+                self.idle.append(worker)
+
+    def close(self):
+        """Stop the worker processes
+
+        Calls which are still running are stopped, and raise RuntimeError.
+        This doesn't wait for the processes to exit.
+        """
+        for worker in self.workers:
+            worker.close(kill=worker not in self.idle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,17 +1,38 @@
 import codecs
+import sys
+import time
 
 from qtpy import QtCore
 
-from .core import SignalQueue, Cancelled
+from .core import (
+    SignalPlumbing, SignalCatcher, Cancelled, Semaphore, start_async, with_timeout,
+)
+
+__all__ = [
+    "accept_connections",
+    "debounce",
+    "fetch",
+    "read_lines",
+    "read_streaming_bytes",
+    "read_streaming_text",
+    "run_in_thread",
+    "run_process",
+    "serve_connections",
+    "sleep",
+    "sleep_loop",
+    "throttle",
+    "write_all",
+]
 
 
 async def sleep(ms):
     """Wait for ms (milliseconds) to elapse"""
-    timer = QtCore.QTimer()
-    timer.setSingleShot(True)
-    sq = SignalQueue(timer.timeout, max_buffer_size=1)
-    timer.start(ms)
-    await sq
+    plumbing = SignalPlumbing.forCurrentThread()
+    timer = plumbing.timer_at(time.monotonic() + ms / 1000)
+    try:
+        await timer
+    finally:
+        timer.cancel()
 
 async def sleep_loop(ms):
     """Use ``async for _ in sleep_loop(ms):`` to wake up at regular intervals
@@ -19,52 +40,223 @@ async def sleep_loop(ms):
     If the code in the loop takes longer than the timer interval, the next
     iteration will start straight away, but it won't try to catch up with a backlog.
     """
-    timer = QtCore.QTimer()
-    sq = SignalQueue(timer.timeout, max_buffer_size=1)
-    timer.start(ms)
+    plumbing = SignalPlumbing.forCurrentThread()
+    due = time.monotonic()
     while True:
-        await sq
+        due = max(due + ms / 1000, time.monotonic())
+        timer = plumbing.timer_at(due)
+        try:
+            await timer
+        finally:
+            timer.cancel()
         yield
 
+async def debounce(signal, ms):
+    """Use ``async for sig in debounce(signal, ms):`` to handle bursts of signals
+
+    This yields a ReceivedSignal once the signal has not been emitted for ms
+    (milliseconds), with the arguments from the last emission.
+    """
+    with SignalCatcher(signal, coalesce=True) as sq:
+        while True:
+            sig = await sq
+            while True:
+                try:
+                    sig = await with_timeout(sq, ms)
+                except TimeoutError:
+                    break
+            yield sig
+
+async def throttle(signal, ms):
+    """Use ``async for sig in throttle(signal, ms):`` to limit how often you
+    handle a signal
+
+    This yields a ReceivedSignal at most once every ms (milliseconds). If the
+    signal was emitted several times, you get the latest arguments.
+    """
+    with SignalCatcher(signal, coalesce=True) as sq:
+        while True:
+            yield await sq
+            await sleep(ms)
+
 async def run_process(qproc: QtCore.QProcess, program=None, arguments=None):
     """Start a QProcess and wait for it to finish
 
     Like QProcess.start(), the executable & arguments can be passed in, or
     set beforehand (``.setProgram()`` & ``.setArguments()``).
     """
-    sq = SignalQueue(qproc.finished, qproc.errorOccurred)
-    if program is not None:
-        qproc.start(program, arguments)
-    else:
-        qproc.start()
-    try:
-        sig = await sq
-    except Cancelled:
-        qproc.terminate()
-        raise
+    with SignalCatcher(qproc.finished, qproc.errorOccurred) as sq:
+        if program is not None:
+            qproc.start(program, arguments)
+        else:
+            qproc.start()
+        try:
+            sig = await sq
+        except Cancelled:
+            qproc.terminate()
+            raise
 
     if sig.signal == qproc.errorOccurred:
         raise RuntimeError(f"QProcess failed with error {sig.args[0]}")
     return sig
 
-async def read_streaming_bytes(dev: QtCore.QIODevice, maxSize=4096):
+class _Runnable(QtCore.QRunnable):
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.setAutoDelete(False)  # Python keeps a reference
+
+    def run(self):
+        self.fn()
+
+class _ThreadCall(QtCore.QObject):
+    """Call a function in a worker thread, and signal back when it's done"""
+    finished = QtCore.Signal()
+
+    def __init__(self, func, args):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.done = False
+        self.result = self.exception = None
+        self.waiters = {}
+        self.runnable = _Runnable(self.run)
+        # This object lives in the calling thread, so the signal from the
+        # worker thread is delivered through its event loop.
+        self.finished.connect(self.on_finished)
+
+    def run(self):
+        # In the worker thread
+        try:
+            self.result = self.func(*self.args)
+        except BaseException as e:
+            self.exception = e
+        self.finished.emit()
+
+    @QtCore.Slot()
+    def on_finished(self):
+        self.done = True
+        waiters = list(self.waiters.values())
+        self.waiters.clear()
+        for task in waiters:
+            task.plumbing.step_coro(task, self)
+
+    def __await__(self):
+        if not self.done:
+            yield (self,)
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+async def run_in_thread(func, *args, pool=None):
+    """Call func(*args) in a thread pool, and wait for the result
+
+    This keeps the event loop running while slow functions run. It uses
+    the global QThreadPool unless you pass another one as pool. The pool's
+    ``.setMaxThreadCount()`` controls how many functions run at once.
+    If the task is cancelled before the function starts, it won't be run.
+    """
+    if pool is None:
+        pool = QtCore.QThreadPool.globalInstance()
+    call = _ThreadCall(func, args)
+    pool.start(call.runnable)
+    try:
+        return await call
+    except Cancelled:
+        pool.tryTake(call.runnable)
+        raise
+
+async def write_all(dev: QtCore.QIODevice, data, high_water=64 * 1024):
+    """Write data to a QIODevice, waiting while its write buffer is full
+
+    Devices like QProcess and sockets buffer everything written to them
+    until it can be sent. This writes data in pieces, waiting for the
+    bytesWritten signal whenever more than high_water bytes are waiting, so
+    sending a lot of data doesn't need a lot of memory. When it returns, the
+    last of the data may still be in Qt's buffer.
+    """
+    view = memoryview(data).cast('B')
+    pos = 0
+    signals = [dev.bytesWritten, dev.aboutToClose]
+    if hasattr(dev, 'errorOccurred'):  # QProcess, QAbstractSocket
+        signals.append(dev.errorOccurred)
+    with SignalCatcher(*signals, coalesce='per_signal') as sq:
+        while pos < len(view):
+            room = high_water - dev.bytesToWrite()
+            if room > 0:
+                n = dev.write(bytes(view[pos:pos + room]))
+                if n < 0:
+                    raise OSError(f"Error writing to device: {dev.errorString()}")
+                pos += n
+                continue
+
+            sig = await sq
+            if sig.signal != dev.bytesWritten:
+                raise OSError(f"Error writing to device: {dev.errorString()}")
+
+async def read_streaming_bytes(dev: QtCore.QIODevice, maxSize=4096,
+                               adaptive=False, max_chunk_size=1024 * 1024):
     """Read bytes from a QIODevice as they're reaady
 
     This is used with an 'async for' loop, yielding bytes objects.
+
+    With adaptive=True, maxSize is only the starting chunk size. Each read
+    takes whatever is available, up to the current chunk size, which doubles
+    (up to max_chunk_size) when data is arriving faster than we read it, and
+    shrinks again when it slows down. This means fewer, bigger chunks for
+    bulk transfers.
     """
-    sig_q = SignalQueue(dev.readyRead, dev.readChannelFinished)
-    finished = False
-    while True:
-        while b := dev.read(maxSize):
-            yield b
+    chunk_size = maxSize
+    with SignalCatcher(dev.readyRead, dev.readChannelFinished) as sig_q:
+        finished = False
+        while True:
+            if adaptive:
+                while (n := min(dev.bytesAvailable(), chunk_size)) > 0:
+                    b = dev.read(n)
+                    if not b:
+                        break
+                    if len(b) == chunk_size:
+                        chunk_size = min(chunk_size * 2, max_chunk_size)
+                    elif len(b) < chunk_size // 4:
+                        chunk_size = max(chunk_size // 2, maxSize)
+                    yield b
+            else:
+                while b := dev.read(maxSize):
+                    yield b
 
-        if finished:
-            return
+            if finished:
+                return
 
-        sig = await sig_q
-        if sig.signal == dev.readChannelFinished:
-            # There might still be buffered data to read
-            finished = True
+            sig = await sig_q
+            if sig.signal == dev.readChannelFinished:
+                # There might still be buffered data to read
+                finished = True
+
+async def read_lines(dev: QtCore.QIODevice, max_line_length=None):
+    """Read lines from a QIODevice as they're ready
+
+    This is used with an 'async for' loop, yielding bytes objects. Each ends
+    with a newline (b'\\n'), except perhaps the last one, if the data doesn't
+    end with a newline. If max_line_length is set, ValueError is raised for
+    a longer line, so a misbehaving source can't use up all our memory.
+    """
+    buf = bytearray()
+    async for chunk in read_streaming_bytes(dev, adaptive=True):
+        search_from = len(buf)  # Earlier data has no newlines
+        buf += chunk
+        start = 0
+        while (end := buf.find(b'\n', search_from)) != -1:
+            if max_line_length is not None and end - start > max_line_length:
+                raise ValueError(f"Line longer than {max_line_length} bytes")
+            yield bytes(buf[start:end + 1])
+            start = search_from = end + 1
+        del buf[:start]
+
+        if max_line_length is not None and len(buf) > max_line_length:
+            raise ValueError(f"Line longer than {max_line_length} bytes")
+
+    if buf:
+        yield bytes(buf)
 
 async def read_streaming_text(dev, maxSize=4096, encoding='utf-8', errors='strict'):
     """Read data from a QIODevice as it's ready and decode it to strings
@@ -77,3 +269,82 @@ async def read_streaming_text(dev, maxSize=4096, encoding='utf-8', errors='stric
 
     if s := inc_decoder.decode(b'', final=True):
         yield s
+
+async def accept_connections(server):
+    """Get connections from a QTcpServer or QLocalServer as they arrive
+
+    This is used with an 'async for' loop, yielding socket objects.
+    """
+    with SignalCatcher(server.newConnection, coalesce=True) as sq:
+        while True:
+            while server.hasPendingConnections():
+                yield server.nextPendingConnection()
+            await sq
+
+async def _handle_connection(handler, conn, sem):
+    try:
+        await handler(conn)
+    finally:
+        sem.release()
+        conn.deleteLater()
+
+async def serve_connections(server, handler, max_concurrent=None):
+    """Start ``handler(conn)`` as a new task for each connection to server
+
+    server can be a QTcpServer or a QLocalServer, and handler an ``async def``
+    function. The connection is deleted (``.deleteLater()``) when the handler
+    finishes. If max_concurrent is set, at most that many handlers run at
+    once, and new connections wait in the server's queue until one finishes.
+    If this is cancelled, it cancels the running handlers.
+    """
+    sem = Semaphore(max_concurrent if max_concurrent else sys.maxsize)
+    tasks = set()
+    try:
+        await sem.acquire()
+        async for conn in accept_connections(server):
+            task = start_async(_handle_connection(handler, conn, sem))
+            if not task.done():
+                tasks.add(task)
+                task._add_internal_callback(tasks.discard)
+            await sem.acquire()
+    finally:
+        for task in list(tasks):
+            task.cancel()
+
+async def fetch(request, data=None, max_per_host=6):
+    """Make an HTTP request with a QNetworkRequest, and wait for the response
+
+    The request is a GET, or a POST if data (bytes) is given. This returns a
+    tuple of the finished QNetworkReply and the body of the response (bytes).
+    Check ``reply.error()`` and the status code to see if it succeeded, and
+    call ``reply.deleteLater()`` when you're done with it.
+
+    All requests from the same thread use one QNetworkAccessManager, so they
+    can reuse connections & cached DNS lookups. At most max_per_host requests
+    to the same host & port will be running at once. The limit is shared by
+    all requests to that host, and set by the first one.
+    """
+    from qtpy import QtNetwork
+
+    plumbing = SignalPlumbing.forCurrentThread()
+    if plumbing.network_manager is None:
+        plumbing.network_manager = QtNetwork.QNetworkAccessManager(plumbing)
+    mgr = plumbing.network_manager
+
+    url = request.url()
+    key = (url.scheme(), url.host(), url.port())
+    if (sem := plumbing.host_semaphores.get(key)) is None:
+        sem = plumbing.host_semaphores[key] = Semaphore(max_per_host)
+
+    async with sem:
+        reply = mgr.get(request) if data is None else mgr.post(request, data)
+        with SignalCatcher(reply.finished) as finished:
+            try:
+                chunks = [b async for b in read_streaming_bytes(reply, adaptive=True)]
+                if not reply.isFinished():
+                    await finished
+            except Cancelled:
+                reply.abort()
+                raise
+
+    return reply, b''.join(chunks)
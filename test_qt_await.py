@@ -1,11 +1,22 @@
+import gc
+import os
 import sys
+import threading
 import time
+import weakref
 
 import pytest
 from pytestqt.qt_compat import qt_api
 QtCore = qt_api.QtCore
 
-from qt_await import start_async, sleep, with_timeout, run_process, read_streaming_text
+from qt_await import (
+    start_async, sleep, with_timeout, run_process, read_streaming_bytes,
+    read_streaming_text, read_lines, SignalQueue, SignalCatcher,
+    Cancelled, gather, TaskGroup, run_in_thread, ProcessPool, write_all,
+    serve_connections, fetch, connect_async, debounce, throttle, sleep_loop,
+    LagMonitor, CoroutineStats, move_on_after, fail_after,
+)
+from qt_await.core import SignalPlumbing
 
 @pytest.fixture(scope="session")
 def qapp_cls():
@@ -87,3 +98,910 @@ def test_read_streaming_text(qtbot, qapp):
         start_async(streaming_eg(cb))
 
     assert cb.args[0] == ['0', '1', '2', '3', '4']
+
+
+class Emitter(QtCore.QObject):
+    sig = qt_api.Signal(int)
+
+
+def test_deferred_ping_pong(qtbot):
+    # Two coroutines waking each other would overflow the stack if each one
+    # ran inside the other's signal emission.
+    plumbing = SignalPlumbing.forCurrentThread()
+    a, b = Emitter(), Emitter()
+    qa, qb = SignalQueue(a.sig), SignalQueue(b.sig)
+    n_rounds = 5000
+
+    async def ping(cb):
+        for i in range(n_rounds):
+            b.sig.emit(i)
+            await qa
+        cb(i)
+
+    async def pong():
+        for i in range(n_rounds):
+            await qb
+            a.sig.emit(i)
+
+    plumbing.deferred = True
+    try:
+        with qtbot.waitCallback(timeout=5000) as cb:
+            start_async(pong())
+            start_async(ping(cb))
+    finally:
+        plumbing.deferred = False
+
+    assert cb.args[0] == n_rounds - 1
+
+
+def test_task(qtbot):
+    async def child(ms):
+        await sleep(ms)
+        return ms * 2
+
+    async def failing_child():
+        await sleep(50)
+        raise ValueError("oops")
+
+    async def parent(cb):
+        t1 = start_async(child(100))
+        t2 = start_async(failing_child())
+        t3 = start_async(child(5000))
+        res = await t1
+        try:
+            await t2
+        except ValueError as e:
+            err = e
+        assert t3.cancel()
+        cb(res, err, t1.done(), t3.done(), t3.exception())
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(parent(cb))
+
+    res, err, t1_done, t3_done, t3_exc = cb.args
+    assert res == 200
+    assert isinstance(err, ValueError)
+    assert t1_done
+    assert t3_done
+    assert isinstance(t3_exc, Cancelled)
+
+
+def test_task_callback_error(qtbot, capsys):
+    called = []
+
+    def bad_callback(task):
+        raise ValueError("bad callback")
+
+    async def waiter(task, cb):
+        cb(await task)
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        task = start_async(sleep(10))
+        task.add_done_callback(bad_callback)
+        task.add_done_callback(called.append)
+        start_async(waiter(task, cb))
+
+    assert called == [task]
+    assert "bad callback" in capsys.readouterr().err
+
+
+def test_gather(qtbot):
+    async def child(ms):
+        await sleep(ms)
+        return ms
+
+    async def failing_child():
+        await sleep(50)
+        raise ValueError("oops")
+
+    async def gather_eg(cb):
+        t0 = time.perf_counter()
+        res = await gather(child(200), child(300), child(100))
+        t1 = time.perf_counter()
+
+        try:
+            async with TaskGroup() as tg:
+                slow = tg.start(child(5000))
+                tg.start(failing_child())
+        except ValueError as e:
+            err = e
+
+        # The failing child is started first, and fails before it waits
+        async def fail_now():
+            raise KeyError("oops")
+
+        t2 = time.perf_counter()
+        try:
+            await gather(fail_now(), child(1500))
+        except KeyError as e:
+            err2 = e
+        t3 = time.perf_counter()
+        cb(res, t1 - t0, err, slow.exception(), err2, t3 - t2)
+
+    with qtbot.waitCallback(timeout=3000) as cb:
+        start_async(gather_eg(cb))
+
+    res, elapsed, err, slow_exc, err2, elapsed2 = cb.args
+    assert res == [200, 300, 100]
+    assert 0.25 < elapsed < 0.45
+    assert isinstance(err, ValueError)
+    assert isinstance(slow_exc, Cancelled)
+    assert isinstance(err2, KeyError)
+    assert elapsed2 < 0.1
+
+
+def test_many_sleeps(qtbot):
+    plumbing = SignalPlumbing.forCurrentThread()
+    n_timers = len(plumbing.findChildren(QtCore.QTimer))
+    woken = []
+
+    async def sleeper(ms):
+        await sleep(ms)
+        woken.append(ms)
+
+    async def sleeps_eg(cb):
+        delays = [(i * 37) % 300 for i in range(2000)]
+        await gather(*[sleeper(ms) for ms in delays])
+        cb(len(plumbing.findChildren(QtCore.QTimer)))
+
+    with qtbot.waitCallback(timeout=3000) as cb:
+        start_async(sleeps_eg(cb))
+
+    assert cb.args[0] == n_timers  # No extra QTimers created
+    assert len(woken) == 2000
+
+    # A timer callback failing shouldn't stop other timers
+    def fail():
+        raise ValueError("oops")
+
+    async def sleeps_after_error(cb):
+        plumbing.timer_at(time.monotonic() + 0.01, fail)
+        await gather(sleep(10), sleep(50))
+        cb()
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(sleeps_after_error(cb))
+
+
+def test_signal_queue_close(qtbot):
+    plumbing = SignalPlumbing.forCurrentThread()
+    em = Emitter()
+
+    with SignalQueue(em.sig) as sq:
+        em.sig.emit(1)
+        assert len(sq.signals_q) == 1
+    em.sig.emit(2)
+    assert len(sq.signals_q) == 0
+
+    async def queue_in_task(cb):
+        sq = SignalQueue(em.sig, auto_close=True)
+        with SignalQueue(em.sig, auto_close=True):
+            pass
+        await sleep(10)
+        cb(sq, len(plumbing.current.owned))
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(queue_in_task(cb))
+
+    sq, n_owned = cb.args
+    assert n_owned == 1
+    em.sig.emit(3)
+    assert len(sq.signals_q) == 0  # Disconnected when the task finished
+    assert sq.connections == []
+
+    # Without auto_close, a queue can outlive the task which made it
+    async def make_queue():
+        return SignalQueue(em.sig)
+
+    async def wait_closed(sq):
+        try:
+            await sq
+        except RuntimeError:
+            return 'closed'
+
+    sq = start_async(make_queue()).result()
+    em.sig.emit(4)
+    assert [s.args for s in sq.drain()] == [(4,)]
+
+    # Closing a queue wakes tasks waiting on it
+    task = start_async(wait_closed(sq))
+    sq.close()
+    assert task.result() == 'closed'
+    assert start_async(wait_closed(sq)).result() == 'closed'
+
+    # Queues which are discarded without closing them stop receiving signals
+    def n_receivers():
+        try:
+            return em.receivers(em.sig)
+        except TypeError:  # PySide
+            return em.receivers(QtCore.SIGNAL('sig(int)'))
+
+    n_before = n_receivers()
+    for cls in (SignalQueue, SignalCatcher):
+        ref = weakref.ref(cls(em.sig))
+        gc.collect()
+        assert ref() is None
+        em.sig.emit(5)
+        assert n_receivers() == n_before
+
+
+def test_received_signal():
+    em = Emitter()
+    with SignalQueue(em.sig) as sq:
+        em.sig.emit(5)
+        sig = sq.signals_q[0]
+    value, = sig
+    assert value == 5
+    assert sig[0] == 5
+    assert len(sig) == 1
+    assert sig.sender is em
+    assert sig.args == (5,)
+    assert not hasattr(sig, '__dict__')
+
+
+def test_coalesce(qtbot):
+    em1, em2 = Emitter(), Emitter()
+
+    async def coalesce_eg(cb):
+        received = []
+        with SignalQueue(em1.sig, coalesce=True) as sq:
+            for i in range(10):
+                em1.sig.emit(i)
+            received.append((await sq).args)  # Buffered before we await
+
+            # Emit several times in one event loop iteration
+            QtCore.QTimer.singleShot(0, lambda: [em1.sig.emit(i) for i in range(20)])
+            received.append((await sq).args)
+
+        with SignalQueue(em1.sig, em2.sig, coalesce='per_signal') as sq:
+            for i in range(5):
+                em1.sig.emit(i)
+                em2.sig.emit(i * 10)
+            received.append((await sq).args)
+            received.append((await sq).args)
+        cb(received)
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(coalesce_eg(cb))
+
+    assert cb.args[0] == [(9,), (19,), (4,), (40,)]
+
+
+def test_get_batch(qtbot):
+    em = Emitter()
+
+    async def batch_eg(cb):
+        batches = []
+        with SignalQueue(em.sig) as sq:
+            for i in range(10):
+                em.sig.emit(i)
+            batches.append([s[0] for s in await sq.get_batch(4)])
+            batches.append([s[0] for s in await sq.get_batch()])
+            batches.append(sq.drain())
+
+            QtCore.QTimer.singleShot(10, lambda: em.sig.emit(10))
+            batches.append([s[0] for s in await sq.get_batch()])
+        cb(batches)
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(batch_eg(cb))
+
+    assert cb.args[0] == [[0, 1, 2, 3], [4, 5, 6, 7, 8, 9], [], [10]]
+
+
+def test_plumbing_per_thread(qtbot):
+    plumbing = SignalPlumbing.forCurrentThread()
+    assert SignalPlumbing.forCurrentThread() is plumbing
+
+    class Thread(QtCore.QThread):
+        def run(self):
+            self.tid = threading.get_ident()
+            self.plumbing = SignalPlumbing.forCurrentThread()
+            self.registered = self.tid in SignalPlumbing._thread_insts
+
+    thread = Thread()
+    with qtbot.waitSignal(thread.finished):
+        thread.start()
+    thread.wait()
+
+    assert thread.plumbing is not plumbing
+    assert thread.registered
+    assert thread.tid not in SignalPlumbing._thread_insts
+
+
+def test_run_in_thread(qtbot):
+    pool = QtCore.QThreadPool()
+    pool.setMaxThreadCount(4)
+
+    def slow_func(x):
+        time.sleep(0.2)
+        return x, threading.get_ident()
+
+    def failing_func():
+        raise ValueError("oops")
+
+    async def thread_eg(cb):
+        t0 = time.perf_counter()
+        res = await gather(*[run_in_thread(slow_func, i, pool=pool) for i in range(4)])
+        t1 = time.perf_counter()
+        try:
+            await run_in_thread(failing_func)
+        except ValueError as e:
+            err = e
+        cb(res, t1 - t0, err)
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(thread_eg(cb))
+
+    res, elapsed, err = cb.args
+    assert [x for (x, _) in res] == [0, 1, 2, 3]
+    assert threading.get_ident() not in {tid for (_, tid) in res}
+    assert elapsed < 0.35
+    assert isinstance(err, ValueError)
+
+
+BAD_ERROR_MODULE = """
+class BadError(Exception):
+    def __init__(self, a, b):
+        # Pickles fine, but can't be unpickled, as args doesn't match __init__
+        super().__init__(f"{a}, {b}")
+
+def raise_bad_error():
+    raise BadError(1, 2)
+"""
+
+
+def test_process_pool(qtbot, tmp_path, monkeypatch):
+    # The workers need to import this by name
+    (tmp_path / 'qt_await_bad_error.py').write_text(BAD_ERROR_MODULE)
+    monkeypatch.syspath_prepend(tmp_path)
+    from qt_await_bad_error import raise_bad_error
+
+    async def pool_eg(cb):
+        with ProcessPool(2) as pool:
+            pids = await gather(*[pool.submit(os.getpid) for _ in range(6)])
+            res = await pool.submit(pow, 3, 4)
+            try:
+                await pool.submit(int, 'x')
+            except ValueError as e:
+                err = e
+            try:
+                await with_timeout(pool.submit(time.sleep, 10), 100)
+            except TimeoutError:
+                timed_out = True
+            res2 = await pool.submit(pow, 2, 10)
+            try:
+                await pool.submit(raise_bad_error)
+            except RuntimeError as e:
+                unpickle_err = e
+            res3 = await gather(*[pool.submit(pow, 2, i) for i in range(4)])
+        cb(pids, res, err, timed_out, res2, unpickle_err, res3)
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(pool_eg(cb))
+
+    pids, res, err, timed_out, res2, unpickle_err, res3 = cb.args
+    assert os.getpid() not in pids
+    assert len(set(pids)) == 2  # Workers are reused
+    assert res == 81
+    assert isinstance(err, ValueError)
+    assert timed_out
+    assert res2 == 1024
+    assert 'raise_bad_error' in str(unpickle_err)
+    assert res3 == [1, 2, 4, 8]
+
+
+def test_process_pool_close(qtbot):
+    async def close_eg(cb):
+        pool = ProcessPool(2)
+        procs = [w.proc for w in pool.workers]
+        task = start_async(pool.submit(time.sleep, 10))
+        await sleep(200)
+        t0 = time.perf_counter()
+        pool.close()
+        t1 = time.perf_counter()
+        try:
+            await task
+        except RuntimeError as e:
+            err = e
+        try:
+            await pool.submit(pow, 2, 3)
+        except RuntimeError as e:
+            err2 = e
+        cb(t1 - t0, err, err2, [w.proc for w in pool.workers] == procs)
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(close_eg(cb))
+
+    close_time, err, err2, same_procs = cb.args
+    assert close_time < 0.1  # Doesn't wait for the processes
+    assert 'closed' in str(err)
+    assert 'closed' in str(err2)
+    assert same_procs  # No new workers started after closing
+    qtbot.wait(200)  # Let the event loop clean up the processes
+
+
+def test_read_streaming_bytes_adaptive(qtbot, qapp):
+    async def read_eg(cb, adaptive):
+        qp = QtCore.QProcess(qapp)
+        qp.start(sys.executable, ['-c', 'import sys; sys.stdout.buffer.write(b"x" * 5_000_000)'])
+        chunks = [len(b) async for b in read_streaming_bytes(qp, adaptive=adaptive)]
+        qp.waitForFinished()
+        qp.deleteLater()
+        cb(chunks)
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(read_eg(cb, False))
+    fixed_chunks = cb.args[0]
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(read_eg(cb, True))
+    adaptive_chunks = cb.args[0]
+
+    assert sum(fixed_chunks) == sum(adaptive_chunks) == 5_000_000
+    assert len(adaptive_chunks) < len(fixed_chunks) / 4
+
+
+def test_read_lines(qtbot, qapp):
+    async def lines_eg(cb, code, max_line_length=None):
+        qp = QtCore.QProcess(qapp)
+        qp.start(sys.executable, ['-c', code])
+        lines = []
+        try:
+            async for line in read_lines(qp, max_line_length=max_line_length):
+                lines.append(line)
+        except ValueError as e:
+            lines.append(e)
+        qp.waitForFinished()
+        qp.deleteLater()
+        cb(lines)
+
+    code = ('import time\n'
+            'for i in range(3):\n'
+            '  print("ab", end="", flush=True); time.sleep(0.05)\n'
+            '  print(i, flush=True)\n'
+            'print("x" * 100000 + "\\nlast", end="")')
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(lines_eg(cb, code))
+    assert cb.args[0] == [b'ab0\n', b'ab1\n', b'ab2\n', b'x' * 100000 + b'\n', b'last']
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(lines_eg(cb, code, max_line_length=1000))
+    lines = cb.args[0]
+    assert lines[:3] == [b'ab0\n', b'ab1\n', b'ab2\n']
+    assert isinstance(lines[3], ValueError)
+
+
+def test_write_all(qtbot, qapp):
+    async def write_eg(cb):
+        qp = QtCore.QProcess(qapp)
+        qp.setProcessChannelMode(QtCore.QProcess.ForwardedErrorChannel)
+        qp.start(sys.executable, ['-c', 'import sys; print(len(sys.stdin.buffer.read()))'])
+        await write_all(qp, b'x' * 20_000_000, high_water=100_000)
+        buffered = qp.bytesToWrite()
+        with SignalQueue(qp.finished) as sq:
+            qp.closeWriteChannel()
+            await sq
+        cb(buffered, bytes(qp.readAllStandardOutput()))
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(write_eg(cb))
+
+    buffered, out = cb.args
+    assert buffered <= 100_000
+    assert out.strip() == b'20000000'
+
+
+def test_serve_connections(qtbot, qapp):
+    from qtpy import QtNetwork
+    server = QtNetwork.QTcpServer()
+    assert server.listen(QtNetwork.QHostAddress.LocalHost)
+    running = []
+    max_running = 0
+
+    async def handler(conn):
+        nonlocal max_running
+        running.append(conn)
+        max_running = max(max_running, len(running))
+        async for line in read_lines(conn):
+            await sleep(20)
+            conn.write(line.upper())
+            conn.flush()
+            break
+        running.remove(conn)
+
+    async def client(i):
+        sock = QtNetwork.QTcpSocket(qapp)
+        with SignalQueue(sock.connected) as sq:
+            sock.connectToHost(QtNetwork.QHostAddress.LocalHost, server.serverPort())
+            await sq
+        sock.write(f'hello {i}\n'.encode())
+        async for line in read_lines(sock):
+            sock.deleteLater()
+            return line
+
+    async def serve_eg(cb):
+        serve_task = start_async(serve_connections(server, handler, max_concurrent=5))
+        replies = await gather(*[client(i) for i in range(30)])
+        serve_task.cancel()
+        cb(replies, max_running)
+
+    with qtbot.waitCallback(timeout=5000) as cb:
+        start_async(serve_eg(cb))
+
+    replies, max_running = cb.args
+    assert replies == [f'HELLO {i}\n'.encode() for i in range(30)]
+    assert max_running == 5
+    server.close()
+
+
+def test_serve_connections_error(qtbot, qapp, capsys):
+    from qtpy import QtNetwork
+    server = QtNetwork.QTcpServer()
+    assert server.listen(QtNetwork.QHostAddress.LocalHost)
+
+    async def failing_handler(conn):
+        await sleep(10)
+        raise ValueError("bad handler")
+
+    serve_task = start_async(serve_connections(server, failing_handler))
+    sock = QtNetwork.QTcpSocket(qapp)
+    sock.connectToHost(QtNetwork.QHostAddress.LocalHost, server.serverPort())
+    qtbot.wait(200)
+    serve_task.cancel()
+    sock.deleteLater()
+    server.close()
+
+    out, err = capsys.readouterr()
+    assert "Uncaught exception in" in out
+    assert "bad handler" in err
+
+
+def test_fetch(qtbot):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from qtpy import QtNetwork
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Allow keep-alive
+
+        def do_GET(self):
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.05)
+            body = self.path.encode() * 1000
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                running -= 1
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{httpd.server_address[1]}'
+
+    async def get(path, max_per_host):
+        req = QtNetwork.QNetworkRequest(QtCore.QUrl(base_url + path))
+        reply, body = await fetch(req, max_per_host=max_per_host)
+        status = reply.attribute(QtNetwork.QNetworkRequest.HttpStatusCodeAttribute)
+        reply.deleteLater()
+        return status, body
+
+    async def fetch_eg(cb):
+        # The first request sets the limit for the host
+        cb(await gather(*[get(f'/{i}', 2 if i == 0 else 4) for i in range(8)]))
+
+    try:
+        with qtbot.waitCallback(timeout=5000) as cb:
+            start_async(fetch_eg(cb))
+    finally:
+        httpd.shutdown()
+
+    assert cb.args[0] == [(200, f'/{i}'.encode() * 1000) for i in range(8)]
+    assert max_running == 2
+
+
+def test_connect_async_overflow(qtbot):
+    em = Emitter()
+
+    async def overflow_eg(cb, **kwargs):
+        results = []
+
+        async def slot(i):
+            try:
+                await sleep(50)
+                results.append(i)
+            except Cancelled:
+                results.append(-i)
+                raise
+
+        connect_async(em.sig, slot, **kwargs)
+        for i in range(1, 6):
+            em.sig.emit(i)
+        await sleep(300)
+        em.sig.disconnect()
+        cb(sorted(results))
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(overflow_eg(cb))
+    assert cb.args[0] == [1, 2, 3, 4, 5]
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(overflow_eg(cb, max_concurrent=2, overflow='drop'))
+    assert cb.args[0] == [1, 2]
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(overflow_eg(cb, max_concurrent=1, overflow='queue', max_queued=2))
+    assert cb.args[0] == [1, 4, 5]
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(overflow_eg(cb, max_concurrent=1, overflow='restart'))
+    assert cb.args[0] == [-4, -3, -2, -1, 5]
+
+    async def noop(i):
+        pass
+
+    with pytest.raises(ValueError):
+        connect_async(em.sig, noop, max_concurrent=0, overflow='restart')
+
+
+def test_connect_async_uncaught(qtbot, capsys):
+    em = Emitter()
+
+    async def failing_slot(i):
+        await sleep(10)
+        raise ValueError(f"oops {i}")
+
+    connect_async(em.sig, failing_slot, max_concurrent=2)
+    em.sig.emit(1)
+    qtbot.wait(100)
+
+    out, err = capsys.readouterr()
+    assert "Uncaught exception in" in out
+    assert "oops 1" in err
+
+
+def test_debounce_throttle(qtbot):
+    em = Emitter()
+
+    async def emit_burst():
+        for i in range(10):
+            em.sig.emit(i)
+            await sleep(10)
+
+    async def consume(source, results):
+        async for sig in source:
+            results.append(sig[0])
+
+    async def slot(i):
+        slot_calls.append(i)
+
+    async def debounce_eg(cb):
+        debounced, throttled = [], []
+        t1 = start_async(consume(debounce(em.sig, 50), debounced))
+        t2 = start_async(consume(throttle(em.sig, 45), throttled))
+        await emit_burst()
+        await sleep(150)
+        t1.cancel()
+        t2.cancel()
+        cb(debounced, throttled)
+
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(debounce_eg(cb))
+
+    debounced, throttled = cb.args
+    assert debounced == [9]
+    assert throttled[0] == 0
+    assert throttled[-1] == 9
+    assert 2 <= len(throttled) <= 4
+
+    async def connect_eg(cb):
+        await emit_burst()
+        await sleep(100)
+        em.sig.disconnect()
+        cb()
+
+    slot_calls = []
+    connect_async(em.sig, slot, debounce=50)
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(connect_eg(cb))
+    assert slot_calls == [9]
+
+    slot_calls = []
+    connect_async(em.sig, slot, throttle=45)
+    with qtbot.waitCallback(timeout=1000) as cb:
+        start_async(connect_eg(cb))
+    assert slot_calls[0] == 0
+    assert slot_calls[-1] == 9
+    assert 2 <= len(slot_calls) <= 4
+
+    with pytest.raises(ValueError):
+        connect_async(em.sig, slot, debounce=50, throttle=50)
+
+
+def test_lag_monitor(qtbot):
+    slow_steps = []
+    monitor = LagMonitor(threshold_ms=40, callback=lambda t, ms: slow_steps.append(t))
+
+    async def blocking():
+        await sleep(10)
+        time.sleep(0.05)  # Blocks the event loop
+
+    async def ticker():
+        async for _ in sleep_loop(5):
+            pass
+
+    async def monitor_eg(cb):
+        tick_task = start_async(ticker())
+        block_task = start_async(blocking())
+        await sleep(100)
+        tick_task.cancel()
+        cb(block_task)
+
+    monitor.install()
+    try:
+        with qtbot.waitCallback(timeout=1000) as cb:
+            start_async(monitor_eg(cb))
+    finally:
+        monitor.uninstall()
+
+    assert slow_steps == [cb.args[0]]
+    assert monitor.step_percentiles()[100] >= 50
+    assert monitor.step_percentiles()[50] < 5
+    assert monitor.timer_delay_percentiles()[100] >= 30
+    assert monitor not in SignalPlumbing.forCurrentThread().instruments
+
+    # Installed inside a task. A slow task woken by a signal shouldn't be
+    # counted against the task which emitted the signal.
+    slow_steps.clear()
+    monitor = LagMonitor(threshold_ms=40, callback=lambda t, ms: slow_steps.append(t))
+    emitter = Emitter()
+
+    async def slow_slot():
+        await SignalQueue(emitter.sig)
+        time.sleep(0.05)
+
+    async def emit_eg(cb):
+        monitor.install()
+        monitor.install()
+        slow_task = start_async(slow_slot())
+        await sleep(10)
+        emitter.sig.emit(1)
+        await sleep(10)
+        cb(slow_task)
+
+    try:
+        with qtbot.waitCallback(timeout=1000) as cb:
+            start_async(emit_eg(cb))
+        assert SignalPlumbing.forCurrentThread().instruments == [monitor]
+    finally:
+        monitor.uninstall()
+
+    assert slow_steps == [cb.args[0]]
+
+
+def test_coroutine_stats(qtbot):
+    stats = CoroutineStats()
+
+    async def busy():
+        for _ in range(3):
+            await sleep(20)
+            t_end = time.thread_time() + 0.01
+            while time.thread_time() < t_end:
+                pass
+
+    async def stats_eg(cb):
+        await gather(busy(), busy())
+        cb()
+
+    stats.install()
+    try:
+        with qtbot.waitCallback(timeout=1000) as cb:
+            start_async(stats_eg(cb))
+    finally:
+        stats.uninstall()
+
+    counts = stats.counts['test_coroutine_stats.<locals>.busy']
+    assert counts.steps == 8  # 2 tasks x (start + 3 wakeups)
+    assert 0.055 < counts.cpu < 0.1
+    assert counts.wait > 0.1
+    assert 'test_coroutine_stats.<locals>.busy' in stats.table()
+    assert stats.suspended == {}
+
+
+def test_cancel_scopes(qtbot):
+    emitter = Emitter()
+
+    async def nested(cb):
+        sq = SignalQueue(emitter.sig)
+        t0 = time.perf_counter()
+        async with move_on_after(200) as outer:
+            async with fail_after(2000) as inner:
+                await sq  # Never emitted
+        t1 = time.perf_counter()
+        cb(outer.cancelled_caught, inner.cancelled_caught, t1 - t0)
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(nested(cb))
+
+    assert cb.args[:2] == [True, False]
+    assert 0.1 < cb.args[2] < 0.4
+
+    async def fail(cb):
+        try:
+            async with move_on_after(2000) as outer:
+                async with fail_after(100):
+                    await sleep(1000)
+        except TimeoutError:
+            cb(outer.cancelled_caught)
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(fail(cb))
+
+    assert cb.args == [False]
+
+    async def finish_in_time(cb):
+        async with fail_after(500) as scope:
+            await sleep(50)
+        await sleep(600)  # The deadline shouldn't fire out here
+        cb(scope.cancelled_caught)
+
+    with qtbot.waitCallback(timeout=2000) as cb:
+        start_async(finish_in_time(cb))
+
+    assert cb.args == [False]
+
+
+def test_cancel(qtbot):
+    plumbing = SignalPlumbing.forCurrentThread()
+    emitter = Emitter()
+    queues = []
+
+    async def wait_signal():
+        with SignalQueue(emitter.sig) as sq:
+            queues.append(sq)
+            await sq
+
+    task = start_async(wait_signal())
+    assert task in plumbing.waiting
+    assert task.cancel() is True
+    assert isinstance(task.exception(), Cancelled)
+    assert task not in plumbing.waiting
+    assert queues[0].waiters == {}
+    assert queues[0].connections == []
+    assert task.cancel() is False
+
+    # Cleanup runs through with_timeout
+    qp = QtCore.QProcess()
+
+    async def proc_eg():
+        await with_timeout(run_process(
+            qp, sys.executable, ['-c', 'import time; time.sleep(10)']
+        ), 20_000)
+
+    task = start_async(proc_eg())
+    assert qp.waitForStarted(2000)
+    task.cancel()
+    assert isinstance(task.exception(), Cancelled)
+    assert qp.waitForFinished(2000)
+
+    # A task cancelling itself gets Cancelled at its next await
+    async def cancel_self(cb):
+        plumbing.current.cancel()
+        try:
+            await sleep(1000)
+        except Cancelled:
+            cb('cancelled')
+
+    with qtbot.waitCallback(timeout=500) as cb:
+        start_async(cancel_self(cb))
+
+    assert cb.args == ['cancelled']